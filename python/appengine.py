@@ -4,8 +4,6 @@ from google.appengine.api import taskqueue, urlfetch
 from google.appengine.ext.webapp import RequestHandler, WSGIApplication
 from google.appengine.ext.webapp.util import run_wsgi_app
 
-import crawler
-
 class FlightCrawler(RequestHandler):
     """
     Reusable RequestHandler capable of fetching flights from different
@@ -19,6 +17,9 @@ class FlightCrawler(RequestHandler):
         """
         This is the method called by the appengine Handler.
         """
+        # Imported here so that worker only instances do not pay for it
+        import crawler
+
         flights = None
 
         crawlType = self.request.get("type")
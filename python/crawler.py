@@ -4,15 +4,14 @@ Crawlers for flights available in online gliding competitions.
 This modules provides flight crawlers for popular online gliding competitions.
 
 These crawlers can both download the flights and save them.
+
+Network and html parsing modules are only imported by the methods using them,
+keeping the import of this module (and cold starts of its users) cheap.
 """
 import logging
-import urllib2
 import re
 import sys
 
-from BeautifulSoup import BeautifulSoup
-
-import appdata
 import flight
 
 class BaseCrawler(object):
@@ -20,15 +19,45 @@ class BaseCrawler(object):
     Base class with common functionality to all handlers.
 
     Inheritance could be avoided if we made it a util class.
+
+    self.seen: the tracks already processed (see dedup.SeenTracks), or None
+      to process every track
+    self.fetched: reference of the tracks fetched but not yet processed, by
+      digest, so duplicates within a single crawl are caught too
     """
     gAuthUri = "https://www.google.com/accounts/ClientLogin"
 
     fusionTablesUri = "http://www.google.com/fusiontables/api/query"
 
-    def __init__(self):
-        None
+    def __init__(self, seen=None):
+        self.seen = seen
+        self.fetched = {}
+
+    def lookup(self, rawFlight, reference):
+        """
+        Returns (digest, original) for the given track, original being the
+        reference of the track with the same fixes already processed or
+        fetched (or None if there's none).
+
+        The track is remembered as fetched under the given reference.
+        """
+        digest, original = self.seen.lookup(rawFlight)
+        if original is None and digest is not None:
+            original = self.fetched.setdefault(digest, reference)
+            if original == reference:
+                original = None
+        return digest, original
+
+    def record(self, digest, reference):
+        """
+        Records the track with the given digest as processed (see lookup()).
+        """
+        self.fetched.pop(digest, None)
+        self.seen.record(digest, reference)
 
     def gAuth(self, username, password, service, accountType):
+        import urllib
+        import urllib2
         authData = urllib.urlencode(
                 {"Email": username, "Passwd": password, "service": service, 
                 "accountType": accountType})
@@ -81,7 +110,14 @@ class NetcoupeCrawler(BaseCrawler):
         """
         Returns all the netcoupe defined data (info separated from the stuff
         in the igc file, which the netcoupe does not necessarily use).
+
+        Tracks already processed are not parsed, and an empty flight is
+        returned instead, with extra["duplicateOf"] set to the original track.
+        The track digest is kept in extra["digest"] (see processFlight()).
         """
+        import urllib2
+        from BeautifulSoup import BeautifulSoup
+
         extra = None
         flightUrl = self._baseDetailUrl % flightId
         logging.debug("Fetching flight %d :: %s" % (flightId, flightUrl))
@@ -109,6 +145,7 @@ class NetcoupeCrawler(BaseCrawler):
             "fileid": int(re.match(r".*FileID=(\d+)", items[30].div.a["href"].strip()).groups()[0]),
             "avgSpeed": float(items[32].div.string.replace('&nbsp;km/h','').strip().replace(",",".")),
             "comment": items[44].div.string.strip(' \r\n'),
+            "duplicateOf": None, "digest": None,
         }
 
         # Then parse the actual flight track
@@ -119,13 +156,23 @@ class NetcoupeCrawler(BaseCrawler):
         if flightD.getcode() != 200:
             logging.error("Unexpected code %d processing flight %s" 
                     % (flightD.getcode(), flightUrl))
+        if self.seen is not None:
+            extra["digest"], original = self.lookup(flightData, "netcoupe:%d" % flightId)
+            if original is not None:
+                logging.info("Flight %d is a duplicate of %s, skipping" % (flightId, original))
+                extra["duplicateOf"] = original
+                return flight.Flight(extra=extra)
         parser = flight.FlightParser(flightData, extra=extra)
         return parser.flight
 
-    def processFlight(self, flightId, extra):
+    def processFlight(self, flightId, flight):
         """
-        Processes a single flight (the one from the given id).
+        Processes a single flight (the one from the given id, as returned by
+        getFlight()).
 
         This includes parsing the track and fetching the netcoupe data.
+
+        Once done, the track is recorded as processed (see dedup.SeenTracks).
         """
-        None
+        if self.seen is not None and flight.extra["duplicateOf"] is None:
+            self.record(flight.extra["digest"], "netcoupe:%d" % flightId)
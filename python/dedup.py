@@ -0,0 +1,138 @@
+"""
+Detection of duplicate flight tracks before they're parsed.
+
+This modules provides a persistent set of the tracks already processed, so
+that the same IGC file seen again (under another flight ID, or uploaded
+twice) is linked to the original instead of being parsed and optimized.
+
+Tracks are only recorded once processed, so a track failing to parse or
+process is tried again the next time it's seen.
+
+Tracks are identified by a hash of their fix (B) records only, so changes in
+line endings, headers or security (G) and comment (L) records are ignored.
+"""
+import hashlib
+import os
+
+def trackDigest(rawFlight):
+    """
+    Returns the hash of the fix records of the given IGC track, or None if
+    it has no fixes.
+    """
+    sha, nFixes = hashlib.sha1(), 0
+    for line in rawFlight.split("\n"):
+        if line.startswith("B"):
+            sha.update(line.strip())
+            sha.update("\n")
+            nFixes += 1
+    return sha.hexdigest() if nFixes != 0 else None
+
+class BloomFilter(object):
+    """
+    A bloom filter of hex digests (see trackDigest()).
+
+    self.nBits: size of the filter (bits)
+    self.nHashes: number of bits set per digest
+    self.bits: the filter itself
+    """
+
+    def __init__(self, nBits=8 * 1024 * 1024, nHashes=7):
+        self.nBits = nBits
+        self.nHashes = nHashes
+        self.bits = bytearray(nBits / 8)
+
+    def indexes(self, digest):
+        """
+        Returns the bits of the given digest (double hashing on its halves).
+        """
+        h1, h2 = int(digest[0:16], 16), int(digest[16:32], 16)
+        return [(h1 + i * h2) % self.nBits for i in range(0, self.nHashes)]
+
+    def add(self, digest):
+        """
+        Sets the bits of the given digest.
+        """
+        for i in self.indexes(digest):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+    def __contains__(self, digest):
+        """
+        Returns False if the digest was never added, True if it (probably) was.
+        """
+        for i in self.indexes(digest):
+            if not self.bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+class SeenTracks(object):
+    """
+    Persistent set of the tracks already processed.
+
+    Lookups go first to an in memory bloom filter, so only tracks which are
+    likely duplicates reach the exact (on disk) store for confirmation.
+
+    self.path: location of the exact store (the filter is kept in path.bloom)
+    self.bloom: the BloomFilter of all digests in the store
+    self.store: maps each digest to the reference of its original track
+    """
+
+    def __init__(self, path):
+        """
+        Opens the store, loading (or rebuilding) its bloom filter.
+
+        The saved filter is removed while the store is open, so that it's
+        rebuilt if the store is not closed properly.
+        """
+        import shelve
+
+        self.path = path
+        self.store = shelve.open(path)
+        self.bloom = BloomFilter()
+        bloomPath = "%s.bloom" % path
+        if os.path.exists(bloomPath) and os.path.getsize(bloomPath) == len(self.bloom.bits):
+            bloomFile = open(bloomPath, "rb")
+            try:
+                self.bloom.bits = bytearray(bloomFile.read())
+            finally:
+                bloomFile.close()
+            os.remove(bloomPath)
+        else:
+            for digest in self.store.keys():
+                self.bloom.add(digest)
+
+    def lookup(self, rawFlight):
+        """
+        Returns (digest, original) for the given track, original being the
+        reference of the track already processed with the same fixes (or
+        None if there's none).
+
+        The track is not recorded, call record() once it's been processed.
+        """
+        digest = trackDigest(rawFlight)
+        if digest is None:
+            return None, None
+        if digest in self.bloom and digest in self.store:
+            return digest, self.store[digest]
+        return digest, None
+
+    def record(self, digest, reference):
+        """
+        Records the track with the given digest as processed, under the
+        given reference.
+        """
+        if digest is None:
+            return
+        self.bloom.add(digest)
+        self.store[digest] = reference
+        self.store.sync()
+
+    def close(self):
+        """
+        Saves the bloom filter and closes the store.
+        """
+        bloomFile = open("%s.bloom" % self.path, "wb")
+        try:
+            bloomFile.write(self.bloom.bits)
+        finally:
+            bloomFile.close()
+        self.store.close()
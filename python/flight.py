@@ -3,10 +3,11 @@ Abstraction of a gliding flight track.
 
 This modules provides classes to parse GPS tracks for gliding flights.
 """
-import optparse
 import sys
 
-from datetime import datetime, timedelta
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
 from math import sin, cos, asin, acos, atan2, fabs, sqrt, radians, degrees, pi
 
 class FlightBase(object):
@@ -49,13 +50,20 @@ class FlightBase(object):
                     )
                 ) * self.earthRadius
 
+    def speed(self, p1, p2):
+        """
+        Returns the ground speed (km/h) between the two given points.
+        """
+        return self.distance(p1, p2) * 3600 / max(p2["time"] - p1["time"], 1)
+
     def bearing(self, p1, p2):
         """
-        Returns the bearing (in degrees) from point 1 to point 2.
+        Returns the bearing (in degrees, clockwise from north) from point 1
+        to point 2.
         """
         return degrees(
                 atan2( 
-                    sin(p1["lonrd"] - p2["lonrd"]) * cos(p2["latrd"]), 
+                    sin(p2["lonrd"] - p1["lonrd"]) * cos(p2["latrd"]), 
                     cos(p1["latrd"]) * sin(p2["latrd"]) 
                     - sin(p1["latrd"]) * cos(p2["latrd"]) * cos(p1["lonrd"] - p2["lonrd"])
                 ) % (2 * pi)
@@ -77,23 +85,40 @@ class Flight(FlightBase):
 
     self.extra: extra flight metadata, taken from a source other than the track
       name, club, date, airfield, country, distance, glider, fileid, 
-      avgSpeed, comment
+      avgSpeed, comment, duplicateOf (reference of the original track, if
+      this one was a duplicate), digest (see dedup.trackDigest)
+
+    self.rawFlight: the IGC track the flight was parsed from (None if the
+      points were put otherwise)
 
     self.control: control evaluation of circling, straight, start, etc
       minSpeed: used for flight start / end
       minCircleRate: 
       minCircleTime: min seconds for a spiral to have started
       minStraightTime: min seconds for a spiral to have ended
+      minEnl: min engine noise level (0-999) for the engine to be running
 
     self.points: points of the flight track (and point metadata)
-      time: time of point measurement (down to second)
+      time: time of point measurement, in seconds since midnight (UTC) of the
+        flight date (dte) - going above 86400 if the flight crosses midnight
       lat: latitude (DMS)
       lon: longitude (DMS)
       fix:
       pAlt: pressure altitude
       gAlt: gps altitude
       (check methods computeL* for further point metadata)
+
+    self.extensions: B record extensions (as declared in the I record), one
+      typed column per extension with a value per point (-1 if missing)
+      enl (engine noise level), tas (true airspeed), fxa (fix accuracy),
+      siu (satellites in use), ...
+
+    self.kExtensions: K record extensions (as declared in the J record), with
+      an additional time column (same as the point time)
       
+    self.times: the time of each point, kept for time based queries (see
+      indexAt(), pointsBetween(), resample())
+
     self.phases: the difference flight phases (circling, straight)
 
     self.stats: total flight stats
@@ -105,6 +130,9 @@ class Flight(FlightBase):
 
     STOPPED, STRAIGHT, CIRCLING = range(3)
 
+    # Seconds in a day, added to the point time when crossing midnight
+    DAY = 86400
+
     def __init__(self, extra=None):
         """
         Initiates the internal structures.
@@ -120,24 +148,50 @@ class Flight(FlightBase):
             self.extra = {
                 "name": None, "club": None, "date": None, "airfield": None,
                 "country": None, "distance": -1, "glider": None, "fileid": -1,
-                "avgSpeed": -1, "comment": None,
+                "avgSpeed": -1, "comment": None, "duplicateOf": None,
+                "digest": None,
             }
         self.control = {
             "minSpeed": 50.0, "minCircleRate": 4, "minCircleTime": 45, "minStraightTime": 15,
+            "minEnl": 500,
         }
+        self.rawFlight = None
         self.points = []
+        self.times = array("l")
+        self.dayOffset = 0
+        self.extensions, self.extensionColumns = {}, []
+        self.kExtensions = {}
         self.phases = []
         self.stats = {
             "totalKms": 0.0, "maxAlt": None, "minAlt": None, "maxGSpeed": None, "minGSpeed": None,
         }
 
-    def putPoint(self, time, lat, lon, fix, pAlt, gAlt):
+    def defineExtensions(self, codes):
+        """
+        Creates one (integer) column per given B record extension code.
+        """
+        self.extensions = dict((code, array("i")) for code in codes)
+        self.extensionColumns = [self.extensions[code] for code in codes]
+
+    def putPoint(self, time, lat, lon, fix, pAlt, gAlt, ext=None):
         """
         Adds a new point to the flight track.
 
+        The time is given in seconds since midnight, a time going back more
+        than half a day is taken as crossing midnight (UTC).
+
+        The ext values (if any) must follow the order given to
+        defineExtensions().
+
         In addition, it calculates all the derived metadata (calling the
         compute* methods).
         """
+        if len(self.extensionColumns) != 0:
+            if ext is None:
+                ext = [-1] * len(self.extensionColumns)
+            for column, value in zip(self.extensionColumns, ext):
+                column.append(value)
+        time = self.dayTime(time)
         p = {
             "time": time, "lat": lat, "lon": lon, "fix": fix, "pAlt": pAlt, "gAlt": gAlt,
             "latdg": None, "londg": None, "latrd": None, "lonrd": None,
@@ -155,11 +209,23 @@ class Flight(FlightBase):
         self.computeL1(p)
         if prevP is not None:
             self.computeL2(prevP, p)
-            #self.computeL3(prevP, p)
-            #self.computeStats(p)
+            self.computeL3(prevP, p)
+            self.computeStats(p)
         self.points.append(p)
+        self.times.append(time)
         self.updateMode()
 
+    def dayTime(self, time):
+        """
+        Returns the given time of day as seconds since midnight of the flight
+        date, handling the rollover at midnight.
+        """
+        time += self.dayOffset
+        if len(self.times) != 0 and self.times[-1] - time > Flight.DAY / 2:
+            self.dayOffset += Flight.DAY
+            time += Flight.DAY
+        return time
+
     def computeL1(self, p):
         """
         Computes all point metadata that does not require the previous point.
@@ -178,7 +244,7 @@ s
         """
         p["computeL2"]["distance"] = self.distance(prevP, p)
         p["computeL2"]["bearing"] = self.bearing(prevP, p)
-        p["computeL2"]["timeDelta"] = (p["time"] - prevP["time"]).seconds
+        p["computeL2"]["timeDelta"] = p["time"] - prevP["time"]
         p["computeL2"]["pAltDelta"] = p["pAlt"] - prevP["pAlt"]
         p["computeL2"]["gAltDelta"] = p["gAlt"] - prevP["gAlt"]
 
@@ -186,13 +252,18 @@ s
         """
         Computes point metadata requiring previously computed values.
             (gSpeed, pVario, gVario, turnRate)
+
+        Points repeating the previous time keep the previous values.
         """
+        if p["computeL2"]["timeDelta"] <= 0:
+            p["computeL3"] = dict(prevP["computeL3"])
+            return
         p["computeL3"]["gSpeed"] = (p["computeL2"]["distance"] * 3600) / p["computeL2"]["timeDelta"]
         p["computeL3"]["pVario"] = float(p["computeL2"]["pAltDelta"]) / p["computeL2"]["timeDelta"]
         p["computeL3"]["gVario"] = float(p["computeL2"]["gAltDelta"]) / p["computeL2"]["timeDelta"]
         if prevP["computeL2"]["bearing"] is not None:
-            p["computeL3"]["turnRate"] = (p["computeL2"]["bearing"] \
-                - prevP["computeL2"]["bearing"]) / p["computeL2"]["timeDelta"]
+            p["computeL3"]["turnRate"] = ((p["computeL2"]["bearing"] \
+                - prevP["computeL2"]["bearing"] + 180) % 360 - 180) / p["computeL2"]["timeDelta"]
 
     def computeStats(self, p):
         """
@@ -237,8 +308,8 @@ s
         # Move from straight to circling (>= minTurnRate kept for more than minCircleTime)
         elif p["computeL4"]["mode"] == Flight.STRAIGHT:
             curTime, j = p["time"], pI-1
-            while j > 0 and (p["time"] - self.points[j]["time"]).seconds < self.control["minCircleTime"]:
-                if fabs(self.points[j]["computeL3"]["turnRate"]) >= self.control["minCircleRate"]:
+            while j > 0 and p["time"] - self.points[j]["time"] < self.control["minCircleTime"]:
+                if fabs(self.points[j]["computeL3"]["turnRate"] or 0) >= self.control["minCircleRate"]:
                     j -= 1
                 else:
                     return
@@ -248,8 +319,8 @@ s
         # Move from circling to straight (< minTurnRate for more than minStraightTime)
         elif p["computeL4"]["mode"] == Flight.CIRCLING:
             curTime, j = p["time"], pI-1
-            while j > 0 and (curTime - self.points[j]["time"]).seconds < self.control["minStraightTime"]:
-                if fabs(self.points[j]["computeL3"]["turnRate"]) < self.control["minCircleRate"]:
+            while j > 0 and curTime - self.points[j]["time"] < self.control["minStraightTime"]:
+                if fabs(self.points[j]["computeL3"]["turnRate"] or 0) < self.control["minCircleRate"]:
                     j -= 1
                 else:
                     return
@@ -257,6 +328,65 @@ s
                 self.points[g]["computeL4"]["mode"] = Flight.STRAIGHT
             self.newPhase(pI, Flight.STRAIGHT)
 
+    def indexAt(self, time):
+        """
+        Returns the index of the point at the given time (the last one taken
+        at or before it), or None if the track starts later.
+        """
+        i = bisect_right(self.times, time) - 1
+        return i if i >= 0 else None
+
+    def pointAt(self, time):
+        """
+        Returns the point at the given time (see indexAt()), or None.
+        """
+        i = self.indexAt(time)
+        return self.points[i] if i is not None else None
+
+    def indexRange(self, start, end):
+        """
+        Returns the (first, last + 1) indexes of the points taken between the
+        given times (both inclusive).
+        """
+        return bisect_left(self.times, start), bisect_right(self.times, end)
+
+    def pointsBetween(self, start, end):
+        """
+        Returns the points taken between the given times (both inclusive).
+        """
+        first, last = self.indexRange(start, end)
+        return self.points[first:last]
+
+    def resample(self, rate, start=None, end=None):
+        """
+        Returns the track points at a fixed rate (one every 'rate' seconds),
+        taking for each instant the point at that time (see indexAt()).
+        """
+        if len(self.times) == 0:
+            return []
+        start = self.times[0] if start is None else max(start, self.times[0])
+        end = self.times[-1] if end is None else end
+        return [self.points[self.indexAt(t)] for t in range(start, end + 1, rate)]
+
+    def engineRuns(self, minEnl=None):
+        """
+        Returns the engine runs as a list of (start, end) point indexes.
+
+        Runs are taken from the ENL extension, empty if the logger has none.
+        """
+        minEnl = self.control["minEnl"] if minEnl is None else minEnl
+        enl = self.extensions.get("enl", [])
+        runs, start = [], None
+        for i in range(0, len(enl)):
+            if enl[i] >= minEnl and start is None:
+                start = i
+            elif enl[i] < minEnl and start is not None:
+                runs.append((start, i-1))
+                start = None
+        if start is not None:
+            runs.append((start, len(enl)-1))
+        return runs
+
     def pathInKml(self):
         """
         Returns the flight's track in KML format.
@@ -277,9 +407,12 @@ class FlightParser(FlightBase):
 
     self.flight: the Flight object
     self.rawFlight: the flight in the given IGC format
+    self.bSlices: slices of the B record extensions (compiled from I record)
+    self.kSlices: slices of the K record extensions (compiled from J record)
     """
 
     def __init__(self, rawFlight, extra=None, autoParse=True):
+        self.bSlices, self.kSlices, self.kColumns = [], [], []
         self.flight = Flight(extra=extra)
         self.flight.rawFlight = rawFlight
         if autoParse:
@@ -305,8 +438,9 @@ class FlightParser(FlightBase):
         self.flight.metadata["mfrIdExt"] = record[7:]
 
     def parseB(self, record):
-        self.flight.putPoint(datetime.strptime(record[1:7], "%H%M%S"), record[7:15], record[15:24],
-                record[24], int(record[25:30]), int(record[30:35]))
+        ext = self.decodeExtensions(record, self.bSlices) if self.bSlices else None
+        self.flight.putPoint(self.parseTime(record), record[7:15], record[15:24],
+                record[24], int(record[25:30]), int(record[30:35]), ext)
 
     def parseC(self, record):
         None
@@ -327,13 +461,60 @@ class FlightParser(FlightBase):
             self.flight.metadata[hType] = record[record.find(':')+1:]
 
     def parseI(self, record):
-        None
+        codes, self.bSlices = self.compileExtensions(record)
+        self.flight.defineExtensions(codes)
 
     def parseJ(self, record):
-        None
+        codes, self.kSlices = self.compileExtensions(record)
+        self.flight.kExtensions = dict((code, array("i")) for code in ["time"] + codes)
+        self.kColumns = [self.flight.kExtensions[code] for code in ["time"] + codes]
 
     def parseK(self, record):
-        None
+        if not self.kSlices:
+            return
+        time = self.parseTime(record) + self.flight.dayOffset
+        if len(self.kColumns[0]) != 0 and self.kColumns[0][-1] - time > Flight.DAY / 2:
+            time += Flight.DAY
+        values = [time] + self.decodeExtensions(record, self.kSlices)
+        for column, value in zip(self.kColumns, values):
+            column.append(value)
 
     def parseL(self, record):
         None
+
+    def parseTime(self, record):
+        """
+        Returns the time (HHMMSS) of a B or K record in seconds since midnight.
+        """
+        return int(record[1:3]) * 3600 + int(record[3:5]) * 60 + int(record[5:7])
+
+    def compileExtensions(self, record):
+        """
+        Compiles an I or J record into the extension codes and their slices.
+
+        Each extension is declared as SSFFCCC, the start and finish bytes
+        (1 based, inclusive) and the three letter code.
+        """
+        codes, slices = [], []
+        for i in range(0, int(record[1:3])):
+            field = record[3 + i*7:10 + i*7]
+            codes.append(field[4:7].lower())
+            slices.append(slice(int(field[0:2]) - 1, int(field[2:4])))
+        return codes, slices
+
+    def decodeExtensions(self, record, slices):
+        """
+        Returns the integer values of the extensions in the given record.
+
+        Values which are missing or not numeric are returned as -1.
+        """
+        try:
+            return [int(record[s]) for s in slices]
+        except ValueError:
+            values = []
+            for s in slices:
+                try:
+                    values.append(int(record[s]))
+                except ValueError:
+                    values.append(-1)
+            return values
@@ -0,0 +1,127 @@
+"""
+Measures the import time (cold start) of the ezgliding modules.
+
+This modules imports each given module in a fresh interpreter, reporting the
+time taken and any heavy dependency pulled in at import time. Missing heavy
+dependencies and appengine modules are replaced by stubs, so the check also
+runs where they're not installed.
+
+It exits with a non zero status if any module goes over the time budget or
+imports a heavy dependency, so it can be used as a startup check.
+
+example: python importtime.py --budget 50 shell crawler optimizer
+"""
+import ast
+import os
+import subprocess
+import sys
+
+from optparse import OptionParser
+
+# Entry points and core modules measured by default
+defaultModules = ["appengine", "shell", "crawler", "flight", "optimizer"]
+
+# Dependencies which should only be loaded by the code paths using them
+heavyModules = ["BeautifulSoup", "urllib2", "readline", "shelve", "optparse"]
+
+# Default budget (in milliseconds) for importing a single module
+defaultBudget = 50
+
+# Platform modules missing outside appengine, stubbed so their users can be measured
+platformModules = ["google"]
+
+_probe = """
+import imp, sys, time, types
+
+heavy, stubbable = set(%r), set(%r)
+attempted, stubbed = set(), []
+
+class StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = type(name, (object,), {})
+        setattr(self, name, value)
+        return value
+
+class StubFinder(object):
+    def find_module(self, fullname, path=None):
+        top = fullname.split(".")[0]
+        if top in heavy:
+            attempted.add(top)
+        if top not in stubbable:
+            return None
+        try:
+            imp.find_module(fullname.split(".")[-1], path)
+            return None
+        except ImportError:
+            return self
+
+    def load_module(self, fullname):
+        module = sys.modules.setdefault(fullname, StubModule(fullname))
+        module.__path__, module.__loader__ = [], self
+        stubbed.append(fullname)
+        return module
+
+sys.meta_path.insert(0, StubFinder())
+start = time.time()
+__import__(%r)
+millis = (time.time() - start) * 1000
+loaded = attempted | set(m for m in heavy if sys.modules.get(m) is not None)
+print repr((millis, sorted(loaded), stubbed))
+"""
+
+def measure(module):
+    """
+    Returns (millis, heavy, stubbed) for importing the given module in a
+    fresh interpreter: the time taken, the heavy dependencies it tried to
+    import and the missing modules replaced by stubs.
+
+    Missing heavy dependencies are stubbed too, so importing them still
+    shows up as a failure (see check()).
+
+    Raises RuntimeError if the module fails to import.
+    """
+    probe = subprocess.Popen(
+            [sys.executable, "-c", _probe % (heavyModules,
+                heavyModules + platformModules, module)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = probe.communicate()
+    if probe.returncode != 0:
+        lines = err.strip().split("\n")
+        raise RuntimeError(lines[-1])
+    return ast.literal_eval(out.strip().split("\n")[-1])
+
+def check(modules, budget=defaultBudget):
+    """
+    Measures all the given modules and returns the list of failures.
+    """
+    failures = []
+    for module in modules:
+        try:
+            millis, heavy, stubbed = measure(module)
+        except RuntimeError, e:
+            print "%-12s failed (%s)" % (module, e)
+            failures.append("%s failed to import :: %s" % (module, e))
+            continue
+        print "%-12s %8.2f ms  heavy: %s  stubbed: %s" % (module, millis,
+            ", ".join(heavy) or "-", ", ".join(stubbed) or "-")
+        if millis > budget:
+            failures.append("%s took %.2f ms (budget %d ms)" % (module, millis, budget))
+        if len(heavy) != 0:
+            failures.append("%s imports %s" % (module, ", ".join(heavy)))
+    return failures
+
+def main():
+    parser = OptionParser(usage="%prog [--budget ms] [module ...]")
+    parser.add_option("-b", "--budget", type="int", default=defaultBudget,
+            help="max milliseconds allowed to import each module")
+    options, modules = parser.parse_args()
+    failures = check(modules or defaultModules, options.budget)
+    for failure in failures:
+        print "FAIL: %s" % failure
+    sys.exit(1 if len(failures) != 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cache of flight optimization results.
+
+This modules provides a cache for the circuits calculated by the optimizer.
+
+Entries are keyed by the digest of the track fixes (the same used to detect
+duplicate tracks, see dedup) plus the optimization rule and
+the optimizer version, so changing an algorithm invalidates its old results.
+"""
+import copy
+import hashlib
+import logging
+
+from collections import OrderedDict
+
+import dedup
+
+def trackHash(flight):
+    """
+    Returns a hash of the B record fixes of the given flight.
+
+    This is the digest of the IGC track (see dedup.trackDigest()), kept in
+    flight.extra["digest"] so it's only calculated once. Flights not parsed
+    from a track are hashed from the fix data of their points instead.
+    """
+    digest = flight.extra.get("digest")
+    if digest is None and flight.rawFlight is not None:
+        digest = flight.extra["digest"] = dedup.trackDigest(flight.rawFlight)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha1()
+    for p in flight.points:
+        sha.update("%s%s%s%s%d%d\n" % (p["time"], p["lat"], p["lon"], p["fix"],
+            p["pAlt"], p["gAlt"]))
+    return sha.hexdigest()
+
+class OptimizerCache(object):
+    """
+    Two level cache of optimization results (circuits).
+
+    The first level lives in memory with LRU eviction, the second (optional)
+    is an on disk shelve store.
+
+    self.maxEntries: max number of circuits kept in memory
+    self.path: location of the on disk store (None for memory only)
+    """
+
+    def __init__(self, path=None, maxEntries=256):
+        """
+        Initiates the memory cache and opens the disk store (if any).
+        """
+        self.maxEntries = maxEntries
+        self.path = path
+        self.memory = OrderedDict()
+        self.store = None
+        if path is not None:
+            import shelve
+            try:
+                self.store = shelve.open(path)
+            except Exception, e:
+                logging.warning("Failed to open optimizer cache %s :: %s" % (path, e))
+
+    def key(self, flight, rule, version):
+        """
+        Returns the cache key for the given flight, rule and optimizer version.
+        """
+        return "%s:%s:%s" % (trackHash(flight), rule, version)
+
+    def get(self, key):
+        """
+        Returns (a copy of) the circuit stored under the given key, or None
+        if missing.
+        """
+        if key in self.memory:
+            circuit = self.memory.pop(key)
+            self.memory[key] = circuit
+            return copy.deepcopy(circuit)
+        if self.store is not None and key in self.store:
+            circuit = self.store[key]
+            self.remember(key, circuit)
+            return copy.deepcopy(circuit)
+        return None
+
+    def put(self, key, circuit):
+        """
+        Stores (a copy of) the given circuit in both the memory and disk levels.
+        """
+        circuit = copy.deepcopy(circuit)
+        self.remember(key, circuit)
+        if self.store is not None:
+            self.store[key] = circuit
+            self.store.sync()
+
+    def remember(self, key, circuit):
+        """
+        Puts the given circuit in memory, evicting the least recently used.
+        """
+        self.memory.pop(key, None)
+        self.memory[key] = circuit
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        """
+        Closes the disk store (if any).
+        """
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+# Process wide memory only cache, used when no other is given to the optimizer
+defaultCache = OptimizerCache()
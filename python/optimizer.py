@@ -5,10 +5,36 @@ This modules provides several algorithms to optimize gliding flights.
 
 Optimization means calculating the longest circuit in the gps track.
 """
+import functools
+import logging
+
+from array import array
+from bisect import bisect_left
+
 import flight
+import optcache
 
 from math import sin, cos, asin, acos, atan2, fabs, sqrt, radians, degrees, pi
-from optparse import OptionParser
+
+def cached(method):
+    """
+    Decorator caching the circuit returned by an optimizeN() method.
+
+    The rule is the method name, and the optimizer version is part of the key
+    so that results from older algorithms are not reused.
+
+    The optimizer is only prepared (see prepare()) when the cache misses.
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        key = self.cache.key(self.flight, method.__name__, self.version)
+        circuit = self.cache.get(key)
+        if circuit is None:
+            self.prepare()
+            circuit = method(self)
+            self.cache.put(key, circuit)
+        return circuit
+    return wrapper
 
 class Optimizer(flight.FlightBase):
     """
@@ -24,39 +50,98 @@ class Optimizer(flight.FlightBase):
     It would be good to add in the future:
       4 turnpoints (online contest style)
       FAI triangle
+
+    Results are cached (see optcache), bump version when changing an algorithm.
+
+    Circuit indexes refer to the flight points, but the optimization runs on
+    self.points, the flight points of the longest section without engine runs,
+    and without outliers (see prepare()).
     """
 
-    def __init__(self, flight):
+    version = 3
+
+    # Fixes reached and left faster than this (km/h) are taken as GPS glitches
+    maxSpeed = 500.0
+
+    def __init__(self, flight, cache=None):
         """
         Initiates the optimizer objects.
+
+        If no cache is given the process wide optcache.defaultCache is used.
         """
         self.flight = flight
-        self.maxCPDistance = 0 # Maximum distance between 2 consecutive points
-        self.prepare()
+        self.cache = cache if cache is not None else optcache.defaultCache
+        self.indexes = [] # Flight index of each of self.points
+        self.points = [] # Flight points, without engine runs or outliers
+        self.pathLength = array("d") # Path length from the first point
+        self.prepared = False
 
     def prepare(self):
         """
-        Calculates and stores the maximum distance between any two points.
+        Filters the fixes to optimize and calculates the cumulative path length.
 
-        This is useful for optimization purposes (see forward()).
+        Only the longest section without engine runs is kept (see
+        Flight.engineRuns()), so motor driven legs are never scored.
+
+        Outliers are fixes both reached and left faster than maxSpeed, the
+        typical single fix GPS glitch.
+
+        The path length is useful for optimization purposes (see forward()).
+
+        It's called on the first cache miss, doing nothing if called again.
         """
-        for i in range(0, len(self.flight.points)-1):
-            distance = self.distance(self.flight.points[i], self.flight.points[i+1])
-            if distance > self.maxCPDistance:
-                self.maxCPDistance = distance
+        if self.prepared:
+            return
+        self.prepared = True
+        points = self.flight.points
+        first, last = self.engineFree()
+        for i in range(first, last+1):
+            if len(self.indexes) != 0 and i < last \
+                and self.speed(points[self.indexes[-1]], points[i]) > self.maxSpeed \
+                and self.speed(points[i], points[i+1]) > self.maxSpeed:
+                continue
+            self.indexes.append(i)
+        self.points = [points[i] for i in self.indexes]
+        length = 0.0
+        for i in range(0, len(self.points)):
+            if i > 0:
+                length += self.distance(self.points[i-1], self.points[i])
+            self.pathLength.append(length)
+
+    def engineFree(self):
+        """
+        Returns the (first, last) point indexes of the longest section of the
+        flight without engine runs.
+        """
+        sections, start = [], 0
+        for runStart, runEnd in self.flight.engineRuns():
+            sections.append((start, runStart - 1))
+            start = runEnd + 1
+        sections.append((start, len(self.flight.points) - 1))
+        return max(sections, key=lambda s: s[1] - s[0])
 
     def forward(self, i, distance):
         """
         Evaluates if we can jump points, and returns the next point.
 
-        Knowing the max distance between any 2 points, then we know how many 
-        points forward (at least) we need to achieve that distance.
+        A point can't get further from any other than the path length flown
+        since, so we can jump to the first point where the path length since
+        i reaches the given distance.
+        """
+        return bisect_left(self.pathLength, self.pathLength[i] + distance, i+1)
+
+    def flightCircuit(self, circuit):
+        """
+        Returns the given circuit with indexes of the flight points (instead
+        of self.points).
         """
-        step = int(distance / self.maxCPDistance)
-        if step > 0:
-            return i + step
-        return i+1
+        if circuit["sta"] is None:
+            return circuit
+        return {"sta": self.indexes[circuit["sta"]],
+            "tps": [self.indexes[tp] for tp in circuit["tps"]],
+            "end": self.indexes[circuit["end"]], "distance": circuit["distance"]}
 
+    @cached
     def optimize1(self):
         """
         Optimizes the track for 1 turnpoint (out and return).
@@ -65,19 +150,20 @@ class Optimizer(flight.FlightBase):
           {"sta": ..., "tps": [..], "end": ..., "distance": ...}
         """
         circuit = {"sta": None, "tps": None, "end": None, "distance": 0.0}
-        flight, nPoints = self.flight, len(self.flight.points)
+        points, nPoints = self.points, len(self.points)
         sta, tp1, end = 0, 1, nPoints-1
         while tp1 < nPoints-1:
-            distance = self.distance(flight.points[sta], flight.points[tp1]) \
-                + self.distance(flight.points[tp1], flight.points[end])
+            distance = self.distance(points[sta], points[tp1]) \
+                + self.distance(points[tp1], points[end])
             if distance > circuit["distance"]:
                 circuit = {"sta": sta, "tps": [tp1], "end": end, "distance": distance}
                 tp1 += 1
-                print circuit
+                logging.debug(circuit)
             else:
                 tp1 = self.forward(tp1, 0.5 * (circuit["distance"] - distance))
-        return circuit
+        return self.flightCircuit(circuit)
 
+    @cached
     def optimize2(self):
         """
         Optimizes the track for 2 turnpoints.
@@ -86,22 +172,23 @@ class Optimizer(flight.FlightBase):
           {"sta": ..., "tps": [..], "end": ..., "distance": ...}
         """
         circuit = {"sta": None, "tps": None, "end": None, "distance": 0.0}
-        flight, nPoints = self.flight, len(self.flight.points)
+        points, nPoints = self.points, len(self.points)
         sta, tp1, tp2, end = 0, 1, -1, nPoints-1
         for tp1 in range(1, nPoints-2):
-            leg1 = self.distance(flight.points[sta], flight.points[tp1])
+            leg1 = self.distance(points[sta], points[tp1])
             tp2 = tp1+1
             while tp2 < nPoints-1:
-                distance = leg1 + self.distance(flight.points[tp1], flight.points[tp2]) \
-                    + self.distance(flight.points[tp2], flight.points[end])
+                distance = leg1 + self.distance(points[tp1], points[tp2]) \
+                    + self.distance(points[tp2], points[end])
                 if distance > circuit["distance"]:
                     circuit = {"sta": sta, "tps": [tp1, tp2], "end": end, "distance": distance}
                     tp2 += 1
-                    print circuit
+                    logging.debug(circuit)
                 else:
                     tp2 = self.forward(tp2, 0.5 * (circuit["distance"] - distance))
-        return circuit
+        return self.flightCircuit(circuit)
 
+    @cached
     def optimize3(self):
         """
         Optimizes the track for 3 turnpoints (netcoupe style).
@@ -110,23 +197,23 @@ class Optimizer(flight.FlightBase):
           {"sta": ..., "tps": [..], "end": ..., "distance": ...}
         """
         circuit = {"sta": None, "tps": None, "end": None, "distance": 0.0}
-        flight, nPoints = self.flight, len(self.flight.points)
+        points, nPoints = self.points, len(self.points)
         sta, tp1, tp2, tp3, end = 0, -1, -1, -1, nPoints-1
         for tp1 in range(1, nPoints-3):
-            leg1 = self.distance(flight.points[sta], flight.points[tp1])
+            leg1 = self.distance(points[sta], points[tp1])
             for tp2 in range(tp1+1, nPoints-2):
-                leg2 = self.distance(flight.points[tp1], flight.points[tp2])
+                leg2 = self.distance(points[tp1], points[tp2])
                 tp3 = tp2+1
                 while tp3 < nPoints-1:
-                    leg3 = self.distance(flight.points[tp2], flight.points[tp3])
-                    distance = leg1 + leg2 + leg3 + self.distance(flight.points[tp3], flight.points[end])
+                    leg3 = self.distance(points[tp2], points[tp3])
+                    distance = leg1 + leg2 + leg3 + self.distance(points[tp3], points[end])
                     if distance > circuit["distance"]:
                         circuit = {"sta": sta, "tps": [tp1, tp2, tp3], "end": end, "distance": distance}
-                        print circuit
+                        logging.debug(circuit)
                         tp3 += 1
                     else:
                         tp3 = self.forward(tp3, 0.5 *(circuit["distance"] - distance))
-        return circuit
+        return self.flightCircuit(circuit)
 
     def optimize4(self):
         """
@@ -135,8 +222,9 @@ class Optimizer(flight.FlightBase):
         Returns the circuit:
           {"sta": ..., "tps": [..], "end": ..., "distance": ...}
         """
+        self.prepare()
         circuit = {"sta": None, "tps": None, "end": None, "distance": 0.0}
-        flight, nPoints = self.flight, len(self.flight.points)
+        points, nPoints = self.points, len(self.points)
 
 
 
@@ -151,7 +239,117 @@ class Optimizer(flight.FlightBase):
         turnPts.sort()
 
     def totalKms(self, start, end, turnPts):
-        kms = self.distance(
-        for i in range(0, turnPts):
-            kms += 
+        """
+        Returns the distance of the circuit through the given points, given
+        as flight point indexes (like the circuits returned by optimizeN()).
+        """
+        points = self.flight.points
+        path = [start] + turnPts + [end]
+        kms = 0.0
+        for i in range(0, len(path)-1):
+            kms += self.distance(points[path[i]], points[path[i+1]])
+        return kms
+
+
+class IncrementalOptimizer(flight.FlightBase):
+    """
+    Optimizes a flight as new points are appended to it (live tracking).
+
+    For each point it keeps the best path from the first point ending there,
+    for each number of legs. A new point then only needs evaluating paths
+    ending at it, instead of optimizing the whole flight again.
+
+    Outliers are filtered like in Optimizer, but a glitch is only known once
+    the next point arrives: until then the circuit may end at it. Excluded
+    points are never used as turnpoints afterwards.
+
+    self.nTps: max number of turnpoints
+    self.legs: legs[k][j] is the longest path from the first point to point j
+      with k+1 legs (-1 if there are not enough points)
+    self.parents: parents[k][j] is the previous point in the path of legs[k][j]
+    self.pathLength: path length from the first point to each point, through
+      the points not excluded
+    self.excluded: points taken as GPS glitches (see Optimizer.maxSpeed)
+    self.previous: last point before the newest one which is not excluded
+    """
+
+    maxSpeed = Optimizer.maxSpeed
+
+    def __init__(self, flight, nTps=3):
+        """
+        Initiates the optimizer, optimizing any points already in the flight.
+        """
+        self.flight = flight
+        self.nTps = nTps
+        self.legs = [array("d") for k in range(0, nTps+1)]
+        self.parents = [array("l") for k in range(0, nTps+1)]
+        self.pathLength = array("d")
+        self.excluded = set()
+        self.previous = 0
+        self.update()
+
+    def putPoint(self, *args, **kwargs):
+        """
+        Adds a point to the flight (see Flight.putPoint()), returning the
+        updated best circuit.
+        """
+        self.flight.putPoint(*args, **kwargs)
+        return self.update()
+
+    def update(self):
+        """
+        Evaluates the points added to the flight since the last update,
+        returning the current best circuit.
+        """
+        for j in range(len(self.pathLength), len(self.flight.points)):
+            self.addPoint(j)
+        return self.circuit()
+
+    def addPoint(self, j):
+        """
+        Calculates the best paths ending at point j, after checking if point
+        j-1 is an outlier.
 
+        Paths whose upper bound (previous path plus path length flown since)
+        does not beat the current best are skipped.
+        """
+        points, p = self.flight.points, self.flight.points[j]
+        if j >= 2 and self.speed(points[self.previous], points[j-1]) > self.maxSpeed \
+                and self.speed(points[j-1], p) > self.maxSpeed:
+            self.excluded.add(j-1)
+        elif j >= 1:
+            self.previous = j-1
+        self.pathLength.append(0.0 if j == 0
+            else self.pathLength[self.previous] + self.distance(points[self.previous], p))
+        self.legs[0].append(self.distance(points[0], p))
+        self.parents[0].append(0)
+        for k in range(1, self.nTps+1):
+            best, parent = -1.0, -1
+            prevLegs = self.legs[k-1]
+            for i in range(k, j):
+                if prevLegs[i] + self.pathLength[j] - self.pathLength[i] <= best \
+                        or i in self.excluded:
+                    continue
+                distance = prevLegs[i] + self.distance(points[i], p)
+                if distance > best:
+                    best, parent = distance, i
+            self.legs[k].append(best)
+            self.parents[k].append(parent)
+
+    def circuit(self, nTps=None):
+        """
+        Returns the current best circuit with the given number of turnpoints
+        (default is self.nTps), ending at the last point.
+
+        Returns the circuit:
+          {"sta": ..., "tps": [..], "end": ..., "distance": ...}
+        """
+        nTps = self.nTps if nTps is None else nTps
+        end = len(self.pathLength) - 1
+        if end < 0 or self.legs[nTps][end] < 0:
+            return {"sta": None, "tps": None, "end": None, "distance": 0.0}
+        tps, i = [], end
+        for k in range(nTps, 0, -1):
+            i = self.parents[k][i]
+            tps.insert(0, i)
+        return {"sta": 0, "tps": tps, "end": end, "distance": self.legs[nTps][end]}
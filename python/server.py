@@ -0,0 +1,313 @@
+"""
+A standalone HTTP service analysing flight tracks.
+
+It accepts IGC tracks and returns the flight metadata, stats, phases, wind
+profile and optimized circuits as JSON, without requiring appengine.
+
+Parsing and optimization run in worker processes, one per track, killed if
+they go over the time budget (504). Tracks failing to parse are rejected
+(400), other analysis errors are reported as such (500). The number of tracks queued or being
+analysed is bounded, and new tracks are rejected (503) when it's reached.
+
+  POST /analyse?rules=1,2,3   the IGC track as the request body
+  GET  /health                service status
+  GET  /metrics               request counters and latencies (ms)
+
+example: python server.py --port 8081 --workers 4
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+import urlparse
+
+from collections import deque
+from optparse import OptionParser
+
+import flight
+import optimizer
+import wind
+
+# Max size (bytes) accepted for an uploaded track
+maxTrackSize = 10 * 1024 * 1024
+
+def analyse(rawFlight, rules):
+    """
+    Parses and optimizes the given track, returning the result as a dict.
+
+    This runs in the worker processes, so errors are returned (not raised):
+    {"invalid": ...} for a track failing to parse, {"error": ...} otherwise.
+    """
+    try:
+        track = flight.FlightParser(rawFlight).flight
+    except Exception, e:
+        logging.warning("Failed to parse track :: %s" % traceback.format_exc())
+        return {"invalid": "Invalid IGC track :: %s" % e}
+    if len(track.points) == 0:
+        return {"invalid": "Invalid IGC track :: no fixes"}
+    try:
+        ezopt = optimizer.Optimizer(track)
+        estimator = wind.WindEstimator()
+        circuits = {}
+        for rule in rules:
+            circuits[rule] = getattr(ezopt, "optimize%s" % rule)()
+        metadata = dict(track.metadata)
+        if metadata["dte"] is not None:
+            metadata["dte"] = metadata["dte"].strftime("%Y-%m-%d")
+        return {"metadata": metadata, "stats": track.stats, "phases": track.phases,
+            "extensions": sorted(track.extensions), "nPoints": len(track.points),
+            "engineRuns": track.engineRuns(), "circuits": circuits,
+            "wind": estimator.profile(estimator.estimate(track))}
+    except:
+        return {"error": traceback.format_exc(1)}
+
+def work(conn, rawFlight, rules):
+    """
+    Runs analyse() in a worker process, sending the result to the given
+    connection.
+    """
+    conn.send(analyse(rawFlight, rules))
+    conn.close()
+
+class ServiceBusy(Exception):
+    """
+    Raised when the service has no room for more tracks.
+    """
+
+class AnalysisService(object):
+    """
+    Runs track analysis in worker processes, keeping request metrics.
+
+    self.workers: max tracks being analysed at the same time
+    self.maxPending: max tracks queued or being analysed
+    self.timeout: max seconds to analyse a track (queueing included), after
+      which its worker process is killed
+    self.running: tracks being analysed, waited for through self.available
+    self.counters: requests, rejected, timeouts, invalid, errors
+    self.latencies: latency (ms) of the most recent analysis requests,
+      timeouts included
+    """
+
+    def __init__(self, workers=None, maxPending=16, timeout=60.0):
+        """
+        Initiates the service (worker processes are started per track).
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self.processes = set()
+        self.maxPending = maxPending
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.running = 0
+        self.pending = 0
+        self.counters = {"requests": 0, "rejected": 0, "timeouts": 0, "invalid": 0, "errors": 0}
+        self.latencies = deque(maxlen=1000)
+        self.started = time.time()
+
+    def count(self, counter):
+        """
+        Increments the given counter.
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def analyse(self, rawFlight, rules):
+        """
+        Analyses the given track, waiting at most self.timeout seconds.
+
+        Raises ServiceBusy if maxPending tracks are already being handled,
+        and multiprocessing.TimeoutError if the time budget is exceeded (the
+        worker is then killed, freeing its slot).
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            if self.pending >= self.maxPending:
+                self.counters["rejected"] += 1
+                raise ServiceBusy()
+            self.pending += 1
+        start = time.time()
+        try:
+            analysis = self.run(rawFlight, rules, start + self.timeout)
+        except multiprocessing.TimeoutError:
+            self.count("timeouts")
+            raise
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.latencies.append((time.time() - start) * 1000)
+        if "invalid" in analysis:
+            self.count("invalid")
+        elif "error" in analysis:
+            self.count("errors")
+        return analysis
+
+    def run(self, rawFlight, rules, deadline):
+        """
+        Waits for a free worker and analyses the track in a new process,
+        killing it if the deadline is reached.
+        """
+        with self.lock:
+            while self.running >= self.workers:
+                if time.time() >= deadline:
+                    raise multiprocessing.TimeoutError()
+                self.available.wait(deadline - time.time())
+            self.running += 1
+        try:
+            receiver, sender = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(target=work, args=(sender, rawFlight, rules))
+            process.daemon = True
+            process.start()
+            sender.close()
+            with self.lock:
+                self.processes.add(process)
+            try:
+                if not receiver.poll(max(deadline - time.time(), 0)):
+                    raise multiprocessing.TimeoutError()
+                return receiver.recv()
+            except EOFError:
+                return {"error": "Worker exited with code %s" % process.exitcode}
+            finally:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+                receiver.close()
+                with self.lock:
+                    self.processes.discard(process)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.available.notify()
+
+    def health(self):
+        """
+        Returns the service status and current load.
+        """
+        with self.lock:
+            return {"status": "ok", "workers": self.workers, "running": self.running,
+                "pending": self.pending,
+                "maxPending": self.maxPending, "uptime": time.time() - self.started}
+
+    def metrics(self):
+        """
+        Returns the counters and the latency (ms) distribution.
+        """
+        with self.lock:
+            metrics = dict(self.counters)
+            latencies = sorted(self.latencies)
+        if len(latencies) != 0:
+            metrics["latency"] = {
+                "count": len(latencies), "max": latencies[-1],
+                "avg": sum(latencies) / len(latencies),
+                "p50": latencies[len(latencies) / 2],
+                "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            }
+        return metrics
+
+    def close(self):
+        """
+        Stops the running worker processes.
+        """
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.terminate()
+            process.join()
+
+class AnalysisHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Maps the HTTP requests to the AnalysisService (self.server.service).
+    """
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == "/health":
+            self.reply(200, self.server.service.health())
+        elif path == "/metrics":
+            self.reply(200, self.server.service.metrics())
+        else:
+            self.reply(404, {"error": "Unknown path %s" % path})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/analyse":
+            self.reply(404, {"error": "Unknown path %s" % url.path})
+            return
+        try:
+            size = int(self.headers.getheader("content-length", 0))
+        except ValueError:
+            self.reply(400, {"error": "Invalid content-length"})
+            return
+        if size <= 0 or size > maxTrackSize:
+            self.reply(413 if size > 0 else 400, {"error": "Invalid track size %d" % size})
+            return
+        rawFlight = self.rfile.read(size)
+        rules = urlparse.parse_qs(url.query).get("rules", ["1,2,3"])[0].split(",")
+        if not all(rule in ("1", "2", "3") for rule in rules):
+            self.reply(400, {"error": "Invalid rules %s" % ",".join(rules)})
+            return
+        try:
+            analysis = self.server.service.analyse(rawFlight, rules)
+        except ServiceBusy:
+            self.reply(503, {"error": "Too many pending tracks, retry later"})
+            return
+        except multiprocessing.TimeoutError:
+            self.reply(504, {"error": "Analysis took too long"})
+            return
+        if "invalid" in analysis:
+            self.reply(400, {"error": analysis["invalid"]})
+            return
+        self.reply(500 if "error" in analysis else 200, analysis)
+
+    def reply(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug("%s :: %s" % (self.address_string(), format % args))
+
+class AnalysisServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server handling each request in its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, AnalysisHandler)
+        self.service = service
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="localhost", help="address to listen on")
+    parser.add_option("-p", "--port", type="int", default=8081, help="port to listen on")
+    parser.add_option("-w", "--workers", type="int", default=None,
+            help="worker processes (default is one per cpu)")
+    parser.add_option("-q", "--max-pending", type="int", default=16,
+            help="max tracks queued or being analysed")
+    parser.add_option("-t", "--timeout", type="float", default=60.0,
+            help="max seconds to analyse a track")
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = AnalysisService(options.workers, options.max_pending, options.timeout)
+    server = AnalysisServer((options.host, options.port), service)
+    logging.info("Listening on %s:%d" % (options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        None
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
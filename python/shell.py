@@ -2,18 +2,18 @@
 A shell useful while testing ezgliding functionality.
 
 It provides an Cmd based shell to easily trigger each function.
+
+Modules only needed by some commands are imported by those commands, so that
+starting the shell stays fast.
 """
 import cmd
 import logging
-import readline
-import urllib2
+import os
 import subprocess
 import sys
 import traceback
 
-import crawler
-import flight
-import optimizer
+import optcache
 
 def getTraceback():
     """
@@ -35,6 +35,9 @@ class Command(cmd.Cmd):
         logging.basicConfig(level=logging.DEBUG)
 
         self.flight = None
+        self.hotspots = None
+        self.seen = None
+        self.optCache = None
         self.prompt = "ezgliding> "
         self.intro = """
 The ezgliding.com software shell.
@@ -48,9 +51,16 @@ testing purposes. Type 'help' or 'help command' for more information.
         Invokes the given crawler and lists the corresponding flights.
 
         Existing crawlers include: netcoupe
+
+        Tracks already crawled (in this or previous sessions) are skipped.
         """
+        import crawler
+        import dedup
+
         try:
-            crawl = crawler.NetcoupeCrawler()
+            if self.seen is None:
+                self.seen = dedup.SeenTracks(os.path.expanduser("~/.ezgliding-seen"))
+            crawl = crawler.NetcoupeCrawler(seen=self.seen)
             flights = crawl.crawl(crawl.lastProcessedId())
             for flight in flights:
                 crawl.processFlight(flight[0], flight[2])
@@ -70,6 +80,8 @@ testing purposes. Type 'help' or 'help command' for more information.
         if len(params) == 1:
             params.append("netcoupe")
 
+        import crawler
+
         try:
             crawl = None
             if params[1] == "netcoupe":
@@ -90,6 +102,9 @@ testing purposes. Type 'help' or 'help command' for more information.
 
         The location is an URI, file:/// can be used for local files.
         """
+        import urllib2
+        import flight
+
         try:
             track = urllib2.urlopen(location)
             data = track.read()
@@ -113,16 +128,41 @@ testing purposes. Type 'help' or 'help command' for more information.
 
         TODO: FAI triangle, 4 turnpoints (olc style)
         """
+        import optimizer
+
         optType = int(optType) if optType != "" else 2
 
         if self.flight is not None:
             try:
-                ezopt = optimizer.Optimizer(self.flight)
+                if self.optCache is None:
+                    self.optCache = optcache.OptimizerCache(
+                            path=os.path.expanduser("~/.ezgliding-optcache"))
+                ezopt = optimizer.Optimizer(self.flight, cache=self.optCache)
                 optMethod = getattr(ezopt, "optimize%s" % optType)
-                optMethod()
+                logging.info(optMethod())
             except:
                 logging.error("Failed to optimize :: %s" % getTraceback())
 
+    def do_hotspots(self, minCount):
+        """
+        Adds the currently loaded flight to the thermal hotspots of this
+        session, and lists the hotspots having at least minCount thermals.
+
+        example: hotspots 2
+        """
+        import thermals
+
+        minCount = int(minCount) if minCount != "" else 1
+        try:
+            if self.hotspots is None:
+                self.hotspots = thermals.HotspotMap()
+            if self.flight is not None:
+                self.hotspots.addFlight(self.flight)
+            for hotspot in self.hotspots.hotspots(minCount):
+                logging.info(hotspot)
+        except:
+            logging.error("Failed to compute hotspots :: %s" % getTraceback())
+
     def do_print(self, command):
         """
         Prints details of the currently loaded flight (if any).
@@ -140,6 +180,10 @@ testing purposes. Type 'help' or 'help command' for more information.
         """
         Quits the shell.
         """
+        if self.optCache is not None:
+            self.optCache.close()
+        if self.seen is not None:
+            self.seen.close()
         return True
 
     def do_shell(self, command):
@@ -159,5 +203,6 @@ testing purposes. Type 'help' or 'help command' for more information.
         cmd.Cmd.do_help(self, command)
 
 if __name__ == "__main__":
+    import readline
     ezglider = Command()
     ezglider.cmdloop()
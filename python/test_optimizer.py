@@ -0,0 +1,73 @@
+"""
+Checks of the flight optimizers (see optimizer).
+
+example: python -m unittest test_optimizer
+"""
+import unittest
+
+from math import cos, radians, sin
+
+import flight
+import optcache
+import optimizer
+
+def igcCoordinate(value, width, positive, negative):
+    """
+    Returns the given decimal degrees in IGC (DDMMmmm) format.
+    """
+    cardinal = positive if value >= 0 else negative
+    value = abs(value)
+    degrees, minutes = int(value), (value - int(value)) * 60
+    return ("%0" + str(width) + "d%05d%s") % (degrees, int(round(minutes * 1000)), cardinal)
+
+def trackFixes(nPoints=80, glitch=None):
+    """
+    Returns the fixes (putPoint() arguments) of a zigzag track, one every 4
+    seconds at about 100 km/h, with fix glitch (if given) 50 kms away.
+    """
+    fixes = []
+    lat, lon = 45.0, 6.0
+    for i in range(0, nPoints):
+        heading = radians(60 if (i / 20) % 2 == 0 else 150)
+        lat += 0.11 * cos(heading) / 111.2
+        lon += 0.11 * sin(heading) / (111.2 * cos(radians(lat)))
+        glitchLat = lat + (0.45 if i == glitch else 0.0)
+        fixes.append((36000 + 4*i, igcCoordinate(glitchLat, 2, "N", "S"),
+            igcCoordinate(lon, 3, "E", "W"), "A", 1000, 1000))
+    return fixes
+
+class IncrementalOptimizerTest(unittest.TestCase):
+
+    def replay(self, fixes):
+        """
+        Returns the incremental optimizer and circuit after adding the fixes
+        one at a time, and the circuit of Optimizer on the whole track.
+        """
+        incremental = optimizer.IncrementalOptimizer(flight.Flight())
+        for fix in fixes:
+            circuit = incremental.putPoint(*fix)
+        ezopt = optimizer.Optimizer(incremental.flight, cache=optcache.OptimizerCache())
+        return incremental, circuit, ezopt.optimize3()
+
+    def testMatchesOptimizer(self):
+        """
+        The live circuit is the one of the whole track optimization.
+        """
+        incremental, circuit, expected = self.replay(trackFixes())
+        self.assertAlmostEqual(circuit["distance"], expected["distance"], 6)
+        self.assertEqual(circuit["end"], expected["end"])
+
+    def testGlitchExcluded(self):
+        """
+        A single fix glitch is excluded once the next fix arrives, and never
+        inflates the live circuit afterwards.
+        """
+        incremental, circuit, expected = self.replay(trackFixes(glitch=30))
+        self.assertEqual(incremental.excluded, set([30]))
+        self.assertNotIn(30, circuit["tps"])
+        self.assertAlmostEqual(circuit["distance"], expected["distance"], 6)
+        clean = self.replay(trackFixes())[1]
+        self.assertAlmostEqual(circuit["distance"], clean["distance"], 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Startup time checks for the ezgliding entry points (see importtime).
+
+example: python -m unittest test_startup
+"""
+import subprocess
+import sys
+import unittest
+
+import importtime
+
+class StartupTest(unittest.TestCase):
+
+    def testImportBudget(self):
+        """
+        Entry points import within budget and without heavy dependencies.
+        """
+        self.assertEqual(importtime.check(importtime.defaultModules), [])
+
+    def testShellStartup(self):
+        """
+        Starting the shell does not load the modules only some commands use.
+        """
+        out = subprocess.check_output([sys.executable, "-c",
+            "import sys, shell; shell.Command(); "
+            "print ' '.join(m for m in %r if sys.modules.get(m) is not None)"
+            % importtime.heavyModules])
+        self.assertEqual(out.strip(), "")
+
+if __name__ == "__main__":
+    unittest.main()
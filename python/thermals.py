@@ -0,0 +1,243 @@
+"""
+Thermal hotspots aggregated from the circling phases of many flights.
+
+This modules provides the extraction of thermals from a flight and a map
+accumulating them over a (possibly large) collection of flights.
+
+The map keeps only per cell aggregates, so memory is bounded by the covered
+area and not by the number of flights, and flights can be added at any time.
+"""
+import cPickle
+import logging
+
+from math import ceil, cos, floor, radians
+
+from flight import Flight, FlightBase
+
+def thermals(flight, minClimb=0.0):
+    """
+    Returns the thermals of the given flight, one per circling phase.
+
+    Each thermal is a dict:
+      {"lat": ..., "lon": ..., "climb": ..., "base": ..., "top": ...,
+       "start": ..., "end": ...}
+    with the centroid in decimal degrees, the average climb rate in m/s, the
+    base and top altitudes and the start and end times.
+    """
+    points = flight.points
+    # Prefer the pressure altitude, unless the logger does not record it
+    alt = "pAlt" if flight.stats["maxAlt"] else "gAlt"
+    result = []
+    for phase in flight.phases:
+        if phase["type"] != Flight.CIRCLING:
+            continue
+        start = phase["start"]
+        end = phase["end"] if phase["end"] is not None else len(points) - 1
+        if end <= start or points[end]["time"] <= points[start]["time"]:
+            continue
+        climb = float(points[end][alt] - points[start][alt]) \
+            / (points[end]["time"] - points[start]["time"])
+        if climb < minClimb:
+            continue
+        lat, lon, base, top = 0.0, 0.0, None, None
+        for p in points[start:end+1]:
+            lat += p["latdg"]
+            lon += p["londg"]
+            base = p[alt] if base is None else min(base, p[alt])
+            top = p[alt] if top is None else max(top, p[alt])
+        n = end - start + 1
+        result.append({"lat": lat / n, "lon": lon / n, "climb": climb,
+            "base": base, "top": top,
+            "start": points[start]["time"], "end": points[end]["time"]})
+    return result
+
+class HotspotMap(FlightBase):
+    """
+    Thermal hotspots built by binning thermals in a lat/lon grid, and merging
+    cells around each local maximum into hotspots.
+
+    self.cellSize: size of each grid cell (decimal degrees)
+    self.mergeRadius: max distance (in cells) from a cell to its hotspot center
+    self.minClimb: thermals climbing less than this (m/s) are ignored
+    self.cells: per cell aggregates, keyed by (lat index, lon index)
+      count, lat, lon, climb, base, top (all but count are sums)
+    self.nFlights: number of flights added so far
+    self.cache: hotspots and their index by center cell (see hotspotIndex()),
+      keyed by minCount and dropped when a thermal is added
+    """
+
+    def __init__(self, cellSize=0.01, minClimb=0.5, mergeRadius=2):
+        """
+        Initiates an empty map.
+        """
+        self.cellSize = cellSize
+        self.mergeRadius = mergeRadius
+        self.minClimb = minClimb
+        self.cells = {}
+        self.nFlights = 0
+        self.cache = {}
+
+    def addFlight(self, flight):
+        """
+        Adds the thermals of the given flight to the map.
+        """
+        for thermal in thermals(flight, self.minClimb):
+            self.addThermal(thermal)
+        self.nFlights += 1
+
+    def addFlights(self, flights):
+        """
+        Adds all the given flights, in one pass (any iterable works, so a
+        generator keeps only one flight in memory at a time).
+        """
+        for flight in flights:
+            try:
+                self.addFlight(flight)
+            except Exception, e:
+                logging.error("Failed to add flight %s to hotspots :: %s" % (flight, e))
+
+    def addThermal(self, thermal):
+        """
+        Adds a single thermal to the aggregates of its cell.
+        """
+        self.cache.clear()
+        key = self.cellOf(thermal["lat"], thermal["lon"])
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = {"count": 0, "lat": 0.0, "lon": 0.0,
+                "climb": 0.0, "base": 0.0, "top": 0.0}
+        cell["count"] += 1
+        for field in ("lat", "lon", "climb", "base", "top"):
+            cell[field] += thermal[field]
+
+    def cellOf(self, lat, lon):
+        """
+        Returns the key of the cell holding the given coordinates.
+        """
+        return int(floor(lat / self.cellSize)), int(floor(lon / self.cellSize))
+
+    def hotspots(self, minCount=1):
+        """
+        Returns the hotspots, sorted by decreasing number of thermals.
+
+        Hotspots are computed once (see clusterCells()) and reused until a
+        new thermal is added.
+        """
+        return self.hotspotIndex(minCount)[0]
+
+    def hotspotIndex(self, minCount=1):
+        """
+        Returns (hotspots, index) for the given minCount, index mapping the
+        cell holding each hotspot center to the hotspots centered in it.
+        """
+        entry = self.cache.get(minCount)
+        if entry is None:
+            hotspots = self.clusterCells(minCount)
+            index = {}
+            for hotspot in hotspots:
+                index.setdefault(self.cellOf(hotspot["lat"], hotspot["lon"]), []).append(hotspot)
+            entry = self.cache[minCount] = (hotspots, index)
+        return entry
+
+    def clusterCells(self, minCount=1):
+        """
+        Returns the hotspots, sorted by decreasing number of thermals.
+
+        Only cells with at least minCount thermals are considered. Each one
+        climbs to its densest neighbour (8 neighbours, ties going to the
+        larger key) until reaching a local maximum, and the cells reaching
+        the same maximum make a hotspot. Cells further than mergeRadius
+        cells from their maximum stay a hotspot of their own, so sparse
+        cells don't chain hotspots across a region.
+
+        Each hotspot is a dict:
+          {"lat": ..., "lon": ..., "count": ..., "climb": ..., "base": ...,
+           "top": ..., "cells": ...}
+        with averages over all the hotspot thermals.
+        """
+        cells = dict((k, cell) for k, cell in self.cells.iteritems() if cell["count"] >= minCount)
+        uphill = {}
+        for (i, j) in cells:
+            best = (cells[(i, j)]["count"], (i, j))
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    neighbour = cells.get((i+di, j+dj))
+                    if neighbour is not None:
+                        best = max(best, (neighbour["count"], (i+di, j+dj)))
+            uphill[(i, j)] = best[1]
+        totals = {}
+        for key in cells:
+            peak = key
+            while uphill[peak] != peak:
+                peak = uphill[peak]
+            if max(abs(peak[0] - key[0]), abs(peak[1] - key[1])) > self.mergeRadius:
+                peak = key
+            total = totals.get(peak)
+            if total is None:
+                total = totals[peak] = {"count": 0, "lat": 0.0, "lon": 0.0, "climb": 0.0,
+                    "base": 0.0, "top": 0.0, "cells": 0}
+            for field, value in cells[key].iteritems():
+                total[field] += value
+            total["cells"] += 1
+        result = totals.values()
+        for total in result:
+            for field in ("lat", "lon", "climb", "base", "top"):
+                total[field] /= total["count"]
+        result.sort(key=lambda h: h["count"], reverse=True)
+        return result
+
+    def hotspotsNear(self, lat, lon, radius, minCount=1):
+        """
+        Returns the hotspots within the given radius (kms) of the given
+        coordinates (decimal degrees), closest first.
+
+        Only the hotspots centered in the cells within the radius are checked
+        (or all of them, if there are fewer hotspots than cells to check).
+        """
+        hotspots, index = self.hotspotIndex(minCount)
+        center = {"latrd": radians(lat), "lonrd": radians(lon)}
+        cellKms = self.earthRadius * radians(self.cellSize)
+        latCells = int(ceil(radius / cellKms))
+        lonCells = int(ceil(radius / (cellKms * max(cos(center["latrd"]), 0.01)))) + 1
+        if (2*latCells + 1) * (2*lonCells + 1) < len(index):
+            i, j = self.cellOf(lat, lon)
+            candidates = []
+            for di in range(-latCells, latCells + 1):
+                for dj in range(-lonCells, lonCells + 1):
+                    candidates.extend(index.get((i+di, j+dj), ()))
+        else:
+            candidates = hotspots
+        near = []
+        for hotspot in candidates:
+            distance = self.distance(center,
+                {"latrd": radians(hotspot["lat"]), "lonrd": radians(hotspot["lon"])})
+            if distance <= radius:
+                near.append((distance, hotspot))
+        near.sort(key=lambda n: n[0])
+        return [hotspot for distance, hotspot in near]
+
+    def save(self, path):
+        """
+        Stores the map in the given file, to be updated later (see load()).
+        """
+        out = open(path, "wb")
+        try:
+            cPickle.dump((self.cellSize, self.minClimb, self.mergeRadius, self.cells, self.nFlights),
+                out, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            out.close()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the map stored in the given file (see save()).
+        """
+        inp = open(path, "rb")
+        try:
+            cellSize, minClimb, mergeRadius, cells, nFlights = cPickle.load(inp)
+        finally:
+            inp.close()
+        hotspotMap = cls(cellSize, minClimb, mergeRadius)
+        hotspotMap.cells, hotspotMap.nFlights = cells, nFlights
+        hotspotMap.cache.clear()
+        return hotspotMap
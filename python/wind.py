@@ -0,0 +1,159 @@
+"""
+Wind estimation from the circling phases of gliding flights.
+
+This modules provides a wind estimator taking each full turn flown while
+circling, and fitting a circle to its ground velocities: circling at a
+constant airspeed, the ground velocities lie on a circle whose center is
+the wind vector.
+
+Estimates are grouped into a wind profile by time period and altitude band,
+either for a single flight or for many flights (same day and region).
+"""
+import logging
+
+from math import sin, cos, atan2, sqrt, radians, degrees
+
+from flight import Flight, FlightBase
+
+class WindEstimator(FlightBase):
+    """
+    Estimates the wind from circling phases (see Flight.phases).
+
+    self.bandSize: altitude band (meters) used in the profiles
+    self.period: time period (seconds) used in the profiles
+    self.minFixes: min fixes in a turn for it to be used
+    self.maxResidual: max fit error (m/s) for a turn to be used
+    """
+
+    def __init__(self, bandSize=500, period=3600, minFixes=6, maxResidual=3.0):
+        self.bandSize = bandSize
+        self.period = period
+        self.minFixes = minFixes
+        self.maxResidual = maxResidual
+
+    def turns(self, flight):
+        """
+        Returns the full turns (360 degrees) of the circling phases, as
+        (start, end) point indexes.
+        """
+        points, turns = flight.points, []
+        for phase in flight.phases:
+            if phase["type"] != Flight.CIRCLING:
+                continue
+            end = phase["end"] if phase["end"] is not None else len(points) - 1
+            start, turned = phase["start"], 0.0
+            for i in range(phase["start"] + 1, end + 1):
+                l2, l3 = points[i]["computeL2"], points[i]["computeL3"]
+                if l3["turnRate"] is not None:
+                    turned += abs(l3["turnRate"]) * l2["timeDelta"]
+                if turned >= 360:
+                    turns.append((start, i))
+                    start, turned = i, 0.0
+        return turns
+
+    def estimate(self, flight):
+        """
+        Returns the wind estimated for each full turn of the given flight.
+
+        Each estimate is a dict:
+          {"start": ..., "end": ..., "alt": ..., "speed": ..., "direction": ...,
+           "airspeed": ..., "residual": ...}
+        with times in seconds, the average altitude, the wind speed (km/h) and
+        the direction it blows from (degrees), the airspeed (km/h) and the fit
+        error (m/s).
+        """
+        points = flight.points
+        alt = "pAlt" if flight.stats["maxAlt"] else "gAlt"
+        estimates = []
+        for start, end in self.turns(flight):
+            # Sums for the least squares fit of u^2 + v^2 = a*u + b*v + c
+            n, su, sv, suu, svv, suv, ss, sus, svs, sss, altSum = [0.0] * 11
+            for p in points[start+1:end+1]:
+                l2 = p["computeL2"]
+                if l2["timeDelta"] <= 0:
+                    continue
+                speed = l2["distance"] * 1000.0 / l2["timeDelta"]
+                u, v = speed * sin(radians(l2["bearing"])), speed * cos(radians(l2["bearing"]))
+                s = u*u + v*v
+                n += 1
+                su, sv, suu, svv, suv = su + u, sv + v, suu + u*u, svv + v*v, suv + u*v
+                ss, sus, svs, sss = ss + s, sus + u*s, svs + v*s, sss + s*s
+                altSum += p[alt]
+            if n < self.minFixes:
+                continue
+            fit = self.solve(((suu, suv, su), (suv, svv, sv), (su, sv, n)), (sus, svs, ss))
+            if fit is None:
+                continue
+            a, b, c = fit
+            wu, wv = a / 2, b / 2
+            radius2 = c + wu*wu + wv*wv
+            if radius2 <= 0:
+                continue
+            sse = sss - 2 * (a*sus + b*svs + c*ss) + a*a*suu + b*b*svv + c*c*n \
+                + 2 * (a*b*suv + a*c*su + b*c*sv)
+            residual = sqrt(max(sse, 0.0) / n) / (2 * sqrt(radius2))
+            if residual > self.maxResidual:
+                continue
+            estimates.append({"start": points[start]["time"], "end": points[end]["time"],
+                "alt": altSum / n, "speed": sqrt(wu*wu + wv*wv) * 3.6,
+                "direction": (degrees(atan2(wu, wv)) + 180) % 360,
+                "airspeed": sqrt(radius2) * 3.6, "residual": residual})
+        return estimates
+
+    def solve(self, m, r):
+        """
+        Solves the 3x3 linear system m * x = r (Cramer's rule), returning
+        None if it has no single solution.
+        """
+        def det(m):
+            return m[0][0] * (m[1][1]*m[2][2] - m[1][2]*m[2][1]) \
+                - m[0][1] * (m[1][0]*m[2][2] - m[1][2]*m[2][0]) \
+                + m[0][2] * (m[1][0]*m[2][1] - m[1][1]*m[2][0])
+        d = det(m)
+        if abs(d) < 1e-9:
+            return None
+        x = []
+        for col in range(0, 3):
+            mc = [[r[row] if c == col else m[row][c] for c in range(0, 3)] for row in range(0, 3)]
+            x.append(det(mc) / d)
+        return x
+
+    def profile(self, estimates, bins=None):
+        """
+        Returns the wind profile for the given estimates, averaging the wind
+        vectors in each time period and altitude band.
+
+        Each profile entry is a dict:
+          {"start": ..., "end": ..., "base": ..., "top": ..., "speed": ...,
+           "direction": ..., "count": ...}
+
+        bins can be given to accumulate over several calls (see batch()).
+        """
+        bins = {} if bins is None else bins
+        for estimate in estimates:
+            key = (int(estimate["start"] // self.period), int(estimate["alt"] // self.bandSize))
+            u = estimate["speed"] * sin(radians(estimate["direction"]))
+            v = estimate["speed"] * cos(radians(estimate["direction"]))
+            b = bins.setdefault(key, [0.0, 0.0, 0])
+            b[0], b[1], b[2] = b[0] + u, b[1] + v, b[2] + 1
+        result = []
+        for (period, band), (u, v, count) in sorted(bins.iteritems()):
+            u, v = u / count, v / count
+            result.append({"start": period * self.period, "end": (period + 1) * self.period,
+                "base": band * self.bandSize, "top": (band + 1) * self.bandSize,
+                "speed": sqrt(u*u + v*v), "direction": degrees(atan2(u, v)) % 360,
+                "count": count})
+        return result
+
+    def batch(self, flights):
+        """
+        Returns the wind profile of all the given flights (usually from the
+        same day and region), in one pass keeping only the profile bins.
+        """
+        bins = {}
+        for flight in flights:
+            try:
+                self.profile(self.estimate(flight), bins)
+            except Exception, e:
+                logging.error("Failed to estimate wind for %s :: %s" % (flight, e))
+        return self.profile([], bins)